@@ -0,0 +1,177 @@
+# 📦 Bulk course generation without the Streamlit UI
+#
+# Generates a syllabus and module content for every learner in a CSV or JSONL
+# file, several learners at a time, and appends one JSON line per learner:
+#
+#   python bulk_generate.py cohort.csv courses.jsonl --workers 4 --modules 2
+#
+# Each input row needs a name and target_skillset; list fields in a CSV are
+# separated by ";". Rows are identified by learner_id (or email, or a hash of
+# the profile), and a rerun with the same output file skips learners that
+# already completed, so an interrupted run can simply be started again.
+
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import streamlit.logger
+
+# The app's cached resources warn about the missing Streamlit runtime on every call
+streamlit.logger.set_log_level("error")
+
+import app
+
+LIST_FIELDS = ("current_skillset", "target_skillset", "learning_goals")
+# The profile form's own defaults, so bulk profiles have the same shape as the app's
+PROFILE_DEFAULTS = {
+    "age": 25,
+    "profession": "Student",
+    "experience_level": "Beginner",
+    "current_skillset": [],
+    "target_skillset": [],
+    "learning_style": "Examples",
+    "time_commitment": "3-5 hours/week",
+    "learning_goals": [],
+    "preferred_format": "Text + Code",
+    "additional_notes": ""
+}
+
+logger = logging.getLogger("learnloom.bulk")
+
+class LearnerProgress(app.ProgressReporter):
+    """Logs agent status updates tagged with the learner they belong to"""
+
+    def __init__(self, learner_id: str):
+        self.learner_id = learner_id
+
+    def info(self, message: str):
+        logger.info("[%s] %s", self.learner_id, message)
+
+    def success(self, message: str):
+        logger.info("[%s] %s", self.learner_id, message)
+
+    def warning(self, message: str):
+        logger.warning("[%s] %s", self.learner_id, message)
+
+    def error(self, message: str):
+        logger.error("[%s] %s", self.learner_id, message)
+
+def read_learners(path: str):
+    """Learner profiles from a CSV or JSONL file, with defaults filled in"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    learners = []
+    for row in rows:
+        profile = {**PROFILE_DEFAULTS, **{k: v for k, v in row.items() if v not in (None, "")}}
+        for key in LIST_FIELDS:
+            if isinstance(profile[key], str):
+                profile[key] = [item.strip() for item in profile[key].split(";") if item.strip()]
+        profile["age"] = int(profile["age"])
+        learner_id = str(profile.pop("learner_id", None) or profile.get("email") or app.SingleFlight.key(profile)[:16])
+        learners.append((learner_id, profile))
+    return learners
+
+def completed_learners(path: str) -> set:
+    """Learners that already have a complete result in the output file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run; that learner is retried
+                continue
+            if record.get("status") == "complete":
+                done.add(record["learner_id"])
+    return done
+
+def generate_course(learner_id: str, profile: dict, llm, researcher, max_modules: int) -> dict:
+    """Syllabus and up to max_modules modules of content for one learner"""
+    session_id = f"bulk_{learner_id}"
+    app.get_request_scope().bind(f"bulk:{learner_id}", session_id)
+    start_time = time.time()
+
+    with app.report_progress(LearnerProgress(learner_id)):
+        state = app.syllabus_generator_agent(app.new_learning_state(profile, session_id), llm, researcher)
+        modules = len(state["syllabus"]) if max_modules < 0 else min(max_modules, len(state["syllabus"]))
+        while state["current_module"] < modules:
+            state = app.content_generator_agent(state, llm, researcher)
+
+    # A fallback syllabus or placeholder module content means a call failed, so retry it on the next run
+    if state.get("error_message"):
+        status = "fallback"
+    elif state.get("failed_modules"):
+        status = "partial"
+    else:
+        status = "complete"
+    return {
+        "learner_id": learner_id,
+        "status": status,
+        "profile": profile,
+        "syllabus": state["syllabus"],
+        "module_contents": {str(idx): text for idx, text in state["module_contents"].items()},
+        "failed_modules": state.get("failed_modules", []),
+        "web_sources": state["web_sources"],
+        "usage": llm.security_monitor.usage.totals(session_id=session_id) if llm.security_monitor else {},
+        "elapsed_seconds": round(time.time() - start_time, 1),
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate courses for a cohort of learners without the UI")
+    parser.add_argument("input", help="CSV or JSONL file of learner profiles")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--workers", type=int, default=app.ADMISSION_MAX_CONCURRENT,
+                        help="learners generated concurrently (default: ADMISSION_MAX_CONCURRENT)")
+    parser.add_argument("--modules", type=int, default=-1,
+                        help="modules of content per learner; 0 for syllabus only, -1 for all (default)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    try:
+        mcp_server, llm, researcher, security_monitor, admission, prefetcher = app.build_services(serve_mcp=False)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+    done = completed_learners(args.output)
+    pending = [(learner_id, profile) for learner_id, profile in read_learners(args.input) if learner_id not in done]
+    logger.info("%d learners to generate (%d already complete)", len(pending), len(done))
+
+    failed = 0
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {
+            pool.submit(generate_course, learner_id, profile, llm, researcher, args.modules): learner_id
+            for learner_id, profile in pending
+        }
+        for future in as_completed(futures):
+            learner_id = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                logger.exception("[%s] generation failed", learner_id)
+                record = {"learner_id": learner_id, "status": "failed", "error": str(e)}
+            if record["status"] != "complete":
+                failed += 1
+            # One flushed line per learner, so an interrupted run loses at most the learners in flight
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            logger.info("[%s] %s", learner_id, record["status"])
+
+    logger.info("Done: %d complete, %d to retry", len(pending) - failed, failed)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
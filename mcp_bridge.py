@@ -0,0 +1,45 @@
+# 🔗 stdio bridge to the LearnLoom MCP JSON-RPC endpoint
+#
+# Lets MCP clients that speak newline-delimited JSON-RPC over stdio read the
+# resources collected by a running app (see MCP_HTTP_PORT in env-template.env).
+#
+#   MCP_SESSION_TOKEN=<signed session token> python mcp_bridge.py
+#
+# The token is shown under "MCP Access Token" in the app's Authentication Details.
+#
+# Each stdin line is forwarded to http://MCP_HTTP_HOST:MCP_HTTP_PORT/rpc and the
+# reply is written to stdout on one line.
+
+import os
+import sys
+import json
+import urllib.request
+import urllib.error
+
+def main():
+    url = f"http://{os.getenv('MCP_HTTP_HOST', '127.0.0.1')}:{os.getenv('MCP_HTTP_PORT', '8765')}/rpc"
+    token = os.getenv("MCP_SESSION_TOKEN", "")
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = urllib.request.Request(
+            url,
+            data=line.encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                body = response.read().decode("utf-8")
+        except urllib.error.HTTPError as e:
+            body = json.dumps({"jsonrpc": "2.0", "id": None, "error": {"code": -32000, "message": f"HTTP {e.code}: {e.read().decode('utf-8', 'replace')}"}})
+        except urllib.error.URLError as e:
+            body = json.dumps({"jsonrpc": "2.0", "id": None, "error": {"code": -32000, "message": f"MCP endpoint unreachable: {e.reason}"}})
+        # Notifications get an empty 204 reply
+        if body:
+            sys.stdout.write(body + "\n")
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()